@@ -10,5 +10,6 @@ from .cmd_line_params import (CmdLineParams, ProductParamType, MapSizeRect,
 from .polar_data import PolarPpiData
 from .product_file import (ProductData, ProductDataPolar, ProductDataRect, ProductDataVertLevels,
     ProductTable, ProductDataType, ProductFile)
-from .lzw15 import compress as lzw15_compress, decompress as lzw15_decompress
+from .lzw15 import (compress as lzw15_compress, compresstobytes as lzw15_compresstobytes,
+    decompress as lzw15_decompress, decompress_into as lzw15_decompress_into)
 from .linker import Linker
\ No newline at end of file
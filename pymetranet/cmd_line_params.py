@@ -894,85 +894,77 @@ class ProdParamsBase(ABC):
             info = self.get_param_info(param_name)
             param = self._product_info.get_param(param_name)
             if info.param_type != ProductParamType.Undefined and param:
-                if info.param_type == ProductParamType.Hidden:
-                    #special case for hidden parameters, handle in a hard-coded
-                    #way the fields 'time' currentsweep' 'volumesweeps' and 'debug'
-                    #all the other fields will be handled forcibly as strings
-                    if param_name == "time":
-                        # TODO: implement custom validation for hidden field time
-                        pass
-                    elif param_name in ["currentsweep", "volumesweeps", "debug"]:
-                        # TODO: implement custom validation for hidden fields
-                        pass
-                    else:
-                        # TODO: implement custom validation for hidden fields
-                        pass
-                            
-                elif info.param_type in [ProductParamType.Pid, ProductParamType.String,
-                        ProductParamType.PathDir, ProductParamType.PathFile,
-                        ProductParamType.CatchmentFile, ProductParamType.RadarNetwork,
-                        ProductParamType.RadarCfg]:
-                    #no validation, accept any value
-                    pass
-                        
-                elif info.param_type == ProductParamType.Enum:
-                    #implement validation for enum
-                    #ppe = param.AsEnum()
-                    #if it's not multi and it's not custom param_value
-                    #must be equal to one of the possible values
-                    if not param.multi and not param.custom:
-                        if param_value not in param.enum_values:
-                            acceptedValues = "|".join(param.enum_values)
-                            raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for enum type. accepted values ({acceptedValues})")
-                    
-                elif info.param_type == ProductParamType.Bool:
-                    #only '0' or '1' are accepted as valid values
-                    if param_value not in ["0", "1"]:
-                        raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for bool type. accepted values (0|1)")
-                    
-                elif info.param_type == ProductParamType.Int:
-                    #validate string as valid integer number
-                    if not re.match(r"^-?\d+$", param_value):
-                        raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for int type. not an integer number")
-                        
-                    #validate range
-                    value = int(param_value)
-                    #paramInt = param.AsInt()
-                    param_range = param.param_range
-                    if param_range.has_range:
-                        if not self.is_in_range(value, param_range.min_val, param_range.max_val):
-                            str_min, str_max = self.get_param_range(param)
-                            rangeValues = "{%s}-{%s}" % (str_min, str_max)
-                            raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for range '{rangeValues}'")
-                                
-                elif info.param_type == ProductParamType.Float:
-                        #validate string as valid float number
-                        if not re.match(r"^-?\d+(\.\d*)?$", param_value):
-                            raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for float type. not a floating point number")
-                                
-                        #validate range
-                        value = float(param_value)
-                        #paramFloat = param.AsFloat()
-                        param_range = param.param_range
-                        if param_range.has_range:
-                            if not self.is_in_range(value, param_range.min_val, param_range.max_val):
-                                str_min, str_max = self.get_param_range(param)
-                                rangeValues = "{%s}-{%s}" % (str_min, str_max)
-                                raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for range '{rangeValues}'")
-                                
-                elif info.param_type == ProductParamType.MapSizeRect:
-                    #validate string as valid mapsizerect
-                    value = ParamMapSizeRectConverter.FromString(param_value)
-                    #paramRect = param
-                    param_range = param.param_range
-                    if param_range.has_range:
-                        if not self.is_in_range(value.x_size, param_range.min_val.x_size,  param_range.val_max.x_size) or \
-                            not self.is_in_range(value.y_size, param_range.val_min.y_size,  param_range.val_max.y_size) or \
-                            not self.is_in_range(value.x_res, param_range.val_min.x_res,  param_range.val_max.x_res) or \
-                            not self.is_in_range(value.y_res, param_range.val_min.y_res,  param_range.val_max.y_res):
-                                str_min, str_max = self.get_param_range(param)
-                                rangeValues = "{%s}-{%s}" % (str_min, str_max)
-                                raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for range '{rangeValues}'")
+                #hidden, pid, string and path like parameters are not in the
+                #table: their values are accepted as they are (hidden fields
+                #'time' 'currentsweep' 'volumesweeps' and 'debug' have no custom
+                #validation yet)
+                validator = ProdParamsBase.__VALIDATORS.get(info.param_type)
+                if validator is not None:
+                    validator(self, param_name, param_value, param)
+
+    def __validate_enum(self, param_name: str, param_value: str, param: ProductParam) -> None:
+        #if it's not multi and it's not custom param_value
+        #must be equal to one of the possible values
+        if not param.multi and not param.custom:
+            if param_value not in param.enum_values:
+                acceptedValues = "|".join(param.enum_values)
+                raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for enum type. accepted values ({acceptedValues})")
+
+    def __validate_bool(self, param_name: str, param_value: str, param: ProductParam) -> None:
+        #only '0' or '1' are accepted as valid values
+        if param_value not in ["0", "1"]:
+            raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for bool type. accepted values (0|1)")
+
+    def __validate_int(self, param_name: str, param_value: str, param: ProductParam) -> None:
+        #validate string as valid integer number
+        if not re.match(r"^-?\d+$", param_value):
+            raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for int type. not an integer number")
+
+        #validate range
+        value = int(param_value)
+        param_range = param.param_range
+        if param_range.has_range:
+            if not self.is_in_range(value, param_range.min_val, param_range.max_val):
+                self.__raise_out_of_range(param_name, param_value, param)
+
+    def __validate_float(self, param_name: str, param_value: str, param: ProductParam) -> None:
+        #validate string as valid float number
+        if not re.match(r"^-?\d+(\.\d*)?$", param_value):
+            raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for float type. not a floating point number")
+
+        #validate range
+        value = float(param_value)
+        param_range = param.param_range
+        if param_range.has_range:
+            if not self.is_in_range(value, param_range.min_val, param_range.max_val):
+                self.__raise_out_of_range(param_name, param_value, param)
+
+    def __validate_mapsizerect(self, param_name: str, param_value: str, param: ProductParam) -> None:
+        #validate string as valid mapsizerect
+        value = ParamMapSizeRectConverter.from_string(param_value)
+        param_range = param.param_range
+        if param_range.has_range:
+            val_min = param_range.min_val
+            val_max = param_range.max_val
+            if not self.is_in_range(value.x_size, val_min.x_size, val_max.x_size) or \
+                not self.is_in_range(value.y_size, val_min.y_size, val_max.y_size) or \
+                not self.is_in_range(value.x_res, val_min.x_res, val_max.x_res) or \
+                not self.is_in_range(value.y_res, val_min.y_res, val_max.y_res):
+                    self.__raise_out_of_range(param_name, param_value, param)
+
+    def __raise_out_of_range(self, param_name: str, param_value: str, param: ProductParam) -> None:
+        str_min, str_max = self.get_param_range(param)
+        rangeValues = "{%s}-{%s}" % (str_min, str_max)
+        raise ValueError(f"parameter '{param_name}': invalid value '{param_value}' for range '{rangeValues}'")
+
+    #validation function of each parameter type, built once when the class is created
+    __VALIDATORS = {
+        ProductParamType.Enum: __validate_enum,
+        ProductParamType.Bool: __validate_bool,
+        ProductParamType.Int: __validate_int,
+        ProductParamType.Float: __validate_float,
+        ProductParamType.MapSizeRect: __validate_mapsizerect,
+    }
         
     def get_param_info(self, param_name: str) -> ProductParamInfo:
         ret = self._map_param_info.get(param_name, ProductParamInfo(None, ProductParamType.Undefined))
@@ -71,24 +71,126 @@ MAX_CODE = 2**DEFAULT_MAX_BITS
 
 FIRST_CODE = 259
 
+#byte strings of length 1 for every byte value, built once at import so
+#that the hot paths index this table instead of packing a new string
+SINGLE_BYTES = tuple(struct.pack("B", pt) for pt in range(256))
+
 def compress(plaintext_bytes):
     """
     Given an iterable of bytes, returns a (hopefully shorter) iterable
     of bytes that you can store in a file or pass over the network or
     what-have-you, and later use to get back your original bytes with
     L{decompress}. This is the best place to start using this module.
+    Contiguous buffers (bytes, memoryview, numpy arrays, ...) are read
+    through the buffer protocol as raw bytes, without copying them.
     """
+    try:
+        plaintext_bytes = memoryview(plaintext_bytes).cast("B")
+    except TypeError:
+        pass
+
     encoder = ByteEncoder()
     return encoder.encodetobytes(plaintext_bytes)
 
 
+def compresstobytes(plaintext_bytes):
+    """
+    Same as L{compress}, but returns all the compressed bytes at once in
+    a single bytes object.
+    """
+    try:
+        plaintext_bytes = memoryview(plaintext_bytes).cast("B")
+    except TypeError:
+        pass
+
+    #the packed byte values are collected straight into a single bytes
+    #object, instead of yielding a string of length 1 for each of them
+    encoder = Encoder(max_code_size=2**DEFAULT_MAX_BITS)
+    packer = BitPacker(initial_code_size=encoder.code_size())
+    return packer.packtobytes(encoder.encode(plaintext_bytes))
+
+
 def decompress(compressed_bytes):
     """
     Given an iterable of bytes that were the result of a call to
     L{compress}, returns an iterator over the uncompressed bytes.
     """
-    decoder = ByteDecoder()
-    return decoder.decodefrombytes(compressed_bytes)
+    return _decode_bytes(compressed_bytes)
+
+
+def _decode_bytes(bytesource):
+    """
+    Same as L{ByteDecoder.decodefrombytes}, but the bit unpacking of
+    L{BitUnpacker} and the decoding of L{Decoder} are done in a single
+    loop, without passing every codepoint through a chain of
+    generators and method calls. The codebook is a list indexed by
+    codepoint, codepoints are always added in sequence.
+    """
+    try:
+        source = memoryview(bytesource).cast("B")
+    except TypeError:
+        source = map(unpackbyte, bytesource)
+
+    single_bytes = SINGLE_BYTES
+    #the control codes occupy their slots in the codebook
+    initial_codebook = list(single_bytes) + [END_OF_INFO_CODE, BUMP_CODE, CLEAR_CODE]
+    codebook = initial_codebook[:]
+    prefix = None
+
+    acc = 0
+    numbits = 0
+    pointwidth = DEFAULT_MIN_BITS
+
+    for value in source:
+        acc = (acc << 8) | value
+        numbits += 8
+
+        while numbits >= pointwidth:
+            numbits -= pointwidth
+            codepoint = acc >> numbits
+            acc &= (1 << numbits) - 1
+
+            if codepoint == BUMP_CODE:
+                pointwidth += 1
+                continue
+            if codepoint == END_OF_INFO_CODE:
+                return
+            if codepoint == CLEAR_CODE:
+                codebook = initial_codebook[:]
+                prefix = None
+                continue
+
+            if codepoint < len(codebook):
+                decoded = codebook[codepoint]
+                if prefix is not None:
+                    codebook.append(prefix + single_bytes[decoded[0]])
+            else:
+                decoded = prefix + single_bytes[prefix[0]]
+                codebook.append(decoded)
+
+            prefix = decoded
+            yield decoded
+
+
+def decompress_into(compressed_bytes, out):
+    """
+    Given an iterable of bytes that were the result of a call to
+    L{compress} and a writable buffer (bytearray, contiguous numpy
+    array, ...), writes the uncompressed bytes at the beginning of the
+    buffer and returns their number. Raises a ValueError if the buffer
+    is too small to hold all the uncompressed bytes.
+    """
+    view = memoryview(out).cast("B")
+    size = len(view)
+    offset = 0
+    for decoded in _decode_bytes(compressed_bytes):
+        end = offset + len(decoded)
+        if end > size:
+            raise ValueError("Output buffer too small for the uncompressed bytes")
+        view[offset:end] = decoded
+        offset = end
+
+    return offset
 
 
 class ByteEncoder():
@@ -212,8 +314,23 @@ class BitPacker():
         >>>  struct.Struct(">B").pack(0xC0), struct.Struct(">B").pack(0x40) ]
         True
         """
+        return map(SINGLE_BYTES.__getitem__, self.__pack_values(codepoints))
+
+
+    def packtobytes(self, codepoints):
+        """
+        Same as L{pack}, but returns all the packed bytes at once in a
+        single bytes object.
+        """
+        return bytes(self.__pack_values(codepoints))
+
 
-        tailbits = []
+    def __pack_values(self, codepoints):
+        #pending bits are kept in an integer accumulator (MSB first)
+        #instead of a list of bits, full bytes are emitted as soon as
+        #more than 8 bits are pending
+        acc = 0
+        numbits = 0
         codesize = self._initial_code_size
 
         minwidth = DEFAULT_MIN_BITS
@@ -222,9 +339,10 @@ class BitPacker():
 
         for pt in codepoints:
 
-            newbits = inttobits(pt, nextwidth)
-
-            tailbits = tailbits + newbits #Last bits in the list.
+            #codepoints wider than nextwidth are not truncated
+            width = max(nextwidth, pt.bit_length())
+            acc = (acc << width) | pt
+            numbits = numbits + width
 
             # PAY ATTENTION. This calculation should be driven by the
             # size of the upstream codebook, right now we're just trusting
@@ -233,8 +351,10 @@ class BitPacker():
             codesize = codesize + 1
 
             if pt == END_OF_INFO_CODE:
-                while len(tailbits) % 8:
-                    tailbits.append(0)
+                #zero pad up to the next byte boundary
+                padding = -numbits % 8
+                acc <<= padding
+                numbits = numbits + padding
 
             if pt == BUMP_CODE:
                 nextwidth = nextwidth + 1
@@ -242,20 +362,14 @@ class BitPacker():
             elif codesize >= MAX_CODE:
                 print("Attention: codesize >= MAX_CODE. Check the python lzw code!")
 
-            while len(tailbits) > 8:
-                nextbits = tailbits[:8]
-                nextbytes = bitstobytes(nextbits)
+            while numbits > 8:
+                numbits = numbits - 8
+                yield acc >> numbits
+                acc &= (1 << numbits) - 1
 
-                for bt in nextbytes:
-                    yield struct.pack("B", bt)
-
-                tailbits = tailbits[8:]
-
-        if tailbits:
-            tail = bitstobytes(tailbits)
-            #print("TAIL:", tailbits)
-            for bt in tail:
-                yield struct.pack("B", bt)
+        if numbits:
+            #last byte, LSBs zero padded
+            yield acc << (8 - numbits)
 
 
 class BitUnpacker():
@@ -294,41 +408,39 @@ class BitUnpacker():
         >>>  struct.Struct(">B").pack(0xC0), struct.Struct(">B").pack(0x40) ]) ]
         [1, 257]
         """
-        bits = []
-        offset = 0
-        ignore = 0
-
-        codesize = self._initial_code_size
-
-        #Uncommented
-        #minwidth = 8
-        #while (1 << minwidth) < codesize:
-        #    minwidth = minwidth + 1
-
-        minwidth = DEFAULT_MIN_BITS
-        pointwidth = minwidth
-
-        for nextbit in bytestobits(bytesource):
-
-            offset = (offset + 1) % 8
-
-            if ignore > 0:
-                ignore = ignore - 1
-                continue
-
-            bits.append(nextbit)
-
-            if len(bits) == pointwidth:
-                codepoint = intfrombits(bits)
-                bits = []
+        #read the source through the buffer protocol when possible (bytes,
+        #bytearray, memoryview, contiguous numpy arrays, ...) so that no copy
+        #is made and every element is already an int, otherwise fall back to
+        #a generic iterable of ints or of 1-byte long byte strings
+        try:
+            source = memoryview(bytesource).cast("B")
+        except TypeError:
+            source = map(unpackbyte, bytesource)
+
+        #bits are accumulated MSB first in an integer, a codepoint is
+        #extracted as soon as enough bits have been read
+        acc = 0
+        numbits = 0
+
+        pointwidth = DEFAULT_MIN_BITS
+
+        for value in source:
+            acc = (acc << 8) | value
+            numbits += 8
+
+            while numbits >= pointwidth:
+                numbits -= pointwidth
+                codepoint = acc >> numbits
+                acc &= (1 << numbits) - 1
                 yield codepoint
-                codesize = codesize + 1
 
                 if codepoint == BUMP_CODE:
                     pointwidth = pointwidth + 1
 
                 if codepoint == END_OF_INFO_CODE:
-                    ignore = (8 - offset) % 8
+                    #ignore the bits up to the next byte boundary
+                    numbits -= numbits % 8
+                    acc &= (1 << numbits) - 1
 
 
 class Decoder():
@@ -361,8 +473,8 @@ class Decoder():
     def decode(self, codepoints):
         """
         Given an iterable of integer codepoints, yields the
-        corresponding bytes, one at a time, as byte strings of length
-        E{1}. Retains the state of the codebook from call to call, so
+        corresponding bytes as byte strings, one string for each
+        decoded codepoint. Retains the state of the codebook from call to call, so
         if you have another stream, you'll likely need another
         decoder!
 
@@ -379,8 +491,6 @@ class Decoder():
         True
 
         """
-        codepoints = [cp for cp in codepoints]
-
         for cp in codepoints:
             if cp == BUMP_CODE:
                 #print("BUMB_CODE reached")
@@ -389,11 +499,11 @@ class Decoder():
                 #print("END_OF_INFO_CODE reached")
                 return
 
+            #the whole decoded string is yielded at once, splitting it
+            #into strings of length 1 only adds per byte overhead
             decoded = self._decode_codepoint(cp)
-
-            for character in iter(decoded):
-                # TODO optimize, casting back to bytes when bytes above
-                yield struct.Struct(">B").pack(character)
+            if decoded:
+                yield decoded
 
 
     def _decode_codepoint(self, codepoint):
@@ -428,11 +538,10 @@ class Decoder():
                 ret = self._codepoints[codepoint]
                 if self._prefix is not None:
                     self._codepoints[len(self._codepoints)] = (
-                        self._prefix + struct.Struct(">B").pack(operator.getitem(ret, 0)))
+                        self._prefix + SINGLE_BYTES[ret[0]])
 
             else:
-                ret = self._prefix + struct.Struct(">B").pack(
-                    operator.getitem(self._prefix, 0))
+                ret = self._prefix + SINGLE_BYTES[self._prefix[0]]
                 self._codepoints[len(self._codepoints)] = ret
 
             self._prefix = ret
@@ -441,8 +550,8 @@ class Decoder():
 
 
     def _clear_codes(self):
-        self._codepoints = dict(
-            (pt, struct.pack("B", pt)) for pt in range(256))
+        #the single byte codes reuse the strings built at import
+        self._codepoints = dict(enumerate(SINGLE_BYTES))
 
         self._codepoints[END_OF_INFO_CODE] = END_OF_INFO_CODE
         self._codepoints[BUMP_CODE] = BUMP_CODE
@@ -550,8 +659,7 @@ class Encoder():
         # we use the byte([]) constructor to conver this back into bytestring
         # so we can add to new_prefix and key the _prefixes by the bytestring.
 
-        byte = point if isinstance(point, bytes) else struct.Struct(">B").pack(
-            point)
+        byte = point if isinstance(point, bytes) else SINGLE_BYTES[point]
         #print(byte)
         new_prefix = self._buffer
         #print(new_prefix)
@@ -573,8 +681,7 @@ class Encoder():
         # Teensy hack, CLEAR_CODE and END_OF_INFO_CODE aren't
         # equal to any possible string.
 
-        self._prefixes = dict(
-            (struct.pack("B", codept), codept) for codept in range(256))
+        self._prefixes = dict(zip(SINGLE_BYTES, range(256)))
         self._prefixes[END_OF_INFO_CODE] = END_OF_INFO_CODE
         self._prefixes[BUMP_CODE] = BUMP_CODE
         self._prefixes[CLEAR_CODE] = CLEAR_CODE
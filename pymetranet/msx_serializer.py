@@ -1,57 +1,89 @@
 #!/bin/env python3
 
+import os
 import struct
+import numpy as np
 from abc import ABC, abstractmethod
+from typing import List
 
 from .volumesweep import PolarSweep
 from .volumesweep import  Ray, Moment, DataMomentHeader
+
+#precompiled structure of the data moment header, common to all versions
+_MOMENT_HEADER = struct.Struct("=II")
+
+#numpy types of the gates for each data format (Fixed8Bit, Float32Bit and Fixed16Bit)
+_GATES_DTYPES = {1: np.dtype(np.uint8), 2: np.dtype(np.float32), 3: np.dtype(np.uint16)}
+
+class _BufferedFile:
+    """
+    Whole content of an open file, read at once into a single writable
+    buffer. Exposes the subset of the file object interface used by the
+    MSx readers, but read returns slices of the buffer instead of newly
+    allocated bytes, so gates built with np.frombuffer on top of them are
+    not copied again and can be modified in place.
+    """
+    def __init__(self, f):
+        buffer = bytearray(os.fstat(f.fileno()).st_size)
+        self._view = memoryview(buffer)[:f.readinto(buffer)]
+        self._pos = 0
+        
+    def read(self, size: int) -> memoryview:
+        ret = self._view[self._pos:self._pos + size]
+        self._pos += len(ret)
+        return ret
+        
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+        
+    def close(self) -> None:
+        #the buffer itself stays alive as long as arrays built on top of it
+        #are referenced, it is released when the last of them is released
+        self._view = memoryview(b"")
+        self._pos = 0
   
 class MSxSerializer(ABC):
     def __init__(self):
         self.eof = True
+        #preallocated buffer filled with readinto by each moment header read
+        self._moment_header_buf = bytearray(_MOMENT_HEADER.size)
         
     @staticmethod
     def stringify(data):
-        return data.decode("utf_8").rstrip('\x00')
+        #strip the null padding before decoding, so that only the
+        #meaningful characters are decoded into a single str
+        return data.rstrip(b'\x00').decode("utf_8")
     
     def load(self, file_name):
-        f = open(file_name, "rb")
-        
-        ret_sweep = PolarSweep()
-        self.eof = False
+        with open(file_name, "rb") as file_obj:
+            #readers access the file content through a single buffer, the
+            #file itself is closed as soon as the sweep is loaded
+            f = _BufferedFile(file_obj)
+            ret_sweep = PolarSweep()
+            self.eof = False
         
-        #read sweep header
-        ret_sweep.sweepheader = self.read_sweep_header(f)
-        if self.eof:
-            return None
-            
-        #read rays
-        while not self.eof:
-            ray = Ray()
-            
-            #read ray header
-            ray.rayheader = self.read_ray_header(f)
+            #read sweep header
+            ret_sweep.sweepheader = self.read_sweep_header(f)
             if self.eof:
-                break
+                return None
             
-            #for each moment
-            for i in range(ret_sweep.sweepheader.nummoments):
-                moment = Moment()
-                mom_info = ret_sweep.sweepheader.momentsinfo[i]
-                
-                #read moment header and gates
-                moment.datamomentheader = self.read_moment_header(f)
-                if self.eof:
-                    break
-                moment.gates = self.read_moment_gates(f, moment.datamomentheader, mom_info.dataformat)
+            #read rays
+            while not self.eof:
+                ray = Ray()
+            
+                #read ray header
+                ray.rayheader = self.read_ray_header(f)
                 if self.eof:
                     break
-                
-                ray.moments.append(moment)
             
-            ret_sweep.rays.append(ray)
+                #read all the moments of the ray
+                ray.moments = self.read_ray_moments(f, ret_sweep.sweepheader)
+            
+                ret_sweep.rays.append(ray)
         
-        f.close()
+            f.close()
         
         return ret_sweep
 
@@ -69,51 +101,50 @@ class MSxSerializer(ABC):
         """
         pass
 
-    def read_moment_header(self, f):
-        ret_data_moment_header = DataMomentHeader()
+    def read_ray_moments(self, f, sweepheader) -> List[Moment]:
+        #moments (data moment header followed by the gates) are stored one
+        #after the other, each of them is decoded by read_moment_header and
+        #read_moment_gates
+        ret_moments = []
+        for i in range(sweepheader.nummoments):
+            moment = Moment()
+            moment.datamomentheader = self.read_moment_header(f)
+            moment.gates = self.read_moment_gates(f, moment.datamomentheader,
+                                                  sweepheader.momentsinfo[i].dataformat)
+            ret_moments.append(moment)
         
-        fmt = "=II"
-        struct_len = struct.calcsize(fmt)
-        data = f.read(struct_len)
-        if not data:
+        return ret_moments
+
+    def read_moment_header(self, f):
+        data = self._moment_header_buf
+        if f.readinto(data) < _MOMENT_HEADER.size:
             f.close()
             self.eof = True
             raise Exception("Error reading data moment header")
-        s = struct.Struct(fmt)
-        unpacked_data = s.unpack(data)
         
-        ret_data_moment_header.momentid = unpacked_data[0]
-        ret_data_moment_header.datasize = unpacked_data[1]
-        
-        return ret_data_moment_header
+        #unpacked fields are momentid and datasize, in the same order
+        #of the DataMomentHeader constructor
+        return DataMomentHeader(*_MOMENT_HEADER.unpack(data))
     
-    def read_moment_gates(self, f, mom_header, data_format):
-        if data_format == 1: #Fixed8Bit
-            num_ele = int(mom_header.datasize / 1)
-            fmt = "=%dB" % num_ele
-        elif data_format == 2: #Float32Bit
-            num_ele = int(mom_header.datasize / 4)
-            fmt = "=%df" % num_ele
-        elif data_format == 3: #Fixed16Bit
-            num_ele = int(mom_header.datasize / 2)
-            fmt = "=%dH" % num_ele
-        else:
+    def read_moment_gates(self, f, mom_header, data_format) -> np.ndarray:
+        dtype = _GATES_DTYPES.get(data_format)
+        if dtype is None:
             f.close()
             self.eof = True
             raise Exception("Error reading moment gates: unrecognized data format")
         
-        struct_len = struct.calcsize(fmt)
-        data = f.read(struct_len)
+        num_ele = mom_header.datasize // dtype.itemsize
+        data = f.read(num_ele * dtype.itemsize)
         if not data:
             f.close()
             self.eof = True
             raise Exception("Error reading moment gates")
-        s = struct.Struct(fmt)
-        unpacked_data = s.unpack(data)
-        
-        ret_gates = [None] * num_ele
-        for i in range(len(unpacked_data)):
-            ret_gates[i] = unpacked_data[i]
         
-        return ret_gates
-        
\ No newline at end of file
+        #gates are returned as a typed numpy array built directly on top of
+        #the bytes read from file, without unpacking them one by one (when
+        #loading a sweep, without copying the file buffer at all). Bytes
+        #read from a plain file object are copied once, to keep the gates
+        #writable
+        if isinstance(data, bytes):
+            data = bytearray(data)
+        return np.frombuffer(data, dtype=dtype)
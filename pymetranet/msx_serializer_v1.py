@@ -5,22 +5,26 @@ from .volumesweep import SweepHeader, MomentInfo
 from .volumesweep import  RayHeader
 from .msx_serializer import MSxSerializer
 
+#precompiled structures of the fixed size records of the v1 format
+_SWEEP_HEADER = struct.Struct("=4sB3BI16s16sfffBBBBBB2BHHffffI")
+_MOMENT_INFO = struct.Struct("=IBB2B12s12sfffB3B")
+_RAY_HEADER = struct.Struct("=IIIHHIfQII")
+
 class MSxV1Serializer(MSxSerializer):
     def __init__(self):
         super().__init__()
+        #preallocated buffer filled with readinto by each ray header read
+        self._ray_header_buf = bytearray(_RAY_HEADER.size)
         
     def read_sweep_header(self, f):
         ret_sweepheader = SweepHeader()
         
-        fmt = "=4sB3BI16s16sfffBBBBBB2BHHffffI"
-        struct_len = struct.calcsize(fmt)
-        data = f.read(struct_len)
+        data = f.read(_SWEEP_HEADER.size)
         if not data:
             f.close()
             self.eof = True
             raise Exception("Error reading sweep header")
-        s = struct.Struct(fmt)
-        unpacked_data = s.unpack(data)
+        unpacked_data = _SWEEP_HEADER.unpack(data)
         
         ret_sweepheader.fileid = MSxSerializer.stringify(unpacked_data[0])
         ret_sweepheader.version = unpacked_data[1]
@@ -47,16 +51,15 @@ class MSxV1Serializer(MSxSerializer):
         ret_sweepheader.metadatasize = unpacked_data[25]
         
         #read moments information
-        fmt = "=IBB2B12s12sfffB3B"
-        struct_len = struct.calcsize(fmt)
-        s = struct.Struct(fmt)
+        #all the moment info structures are read at once and then
+        #unpacked one by one from the same buffer
+        data = f.read(ret_sweepheader.nummoments * _MOMENT_INFO.size)
+        if len(data) < ret_sweepheader.nummoments * _MOMENT_INFO.size:
+            f.close()
+            self.eof = True
+            raise Exception("Error reading moment info structure")
         for i in range(ret_sweepheader.nummoments):
-            data = f.read(struct_len)
-            if not data:
-                f.close()
-                self.eof = True
-                raise Exception("Error reading moment info structure")
-            unpacked_data = s.unpack(data)
+            unpacked_data = _MOMENT_INFO.unpack_from(data, i * _MOMENT_INFO.size)
             
             mom_info = MomentInfo()
             mom_info.momentid = unpacked_data[0]
@@ -90,27 +93,20 @@ class MSxV1Serializer(MSxSerializer):
         return ret_sweepheader
         
     def read_ray_header(self, f):
-        ret_rayheader = RayHeader()
-        
-        fmt = "=IIIHHIfQII"
-        struct_len = struct.calcsize(fmt)
-        data = f.read(struct_len)
-        if not data:
+        data = self._ray_header_buf
+        read = f.readinto(data)
+        if not read:
             self.eof = True
             return None
-        s = struct.Struct(fmt)
-        unpacked_data = s.unpack(data)
+        if read < _RAY_HEADER.size:
+            f.close()
+            self.eof = True
+            raise Exception("Error reading ray header")
         
-        ret_rayheader.length = unpacked_data[0]
-        ret_rayheader.startangle = unpacked_data[1]
-        ret_rayheader.endangle = unpacked_data[2]
-        ret_rayheader.sequence = unpacked_data[3]
-        ret_rayheader.numpulses = unpacked_data[4]
-        ret_rayheader.databytes = unpacked_data[5]
-        ret_rayheader.prf = unpacked_data[6]
-        ret_rayheader.datetime = unpacked_data[7]
-        ret_rayheader.dataflags = unpacked_data[8]
-        ret_rayheader.metadatasize = unpacked_data[9]
+        #unpacked fields are length, startangle, endangle, sequence, numpulses,
+        #databytes, prf, datetime, dataflags and metadatasize, in the same
+        #order of the RayHeader constructor
+        ret_rayheader = RayHeader(*_RAY_HEADER.unpack(data))
         
         #read ray metadata
         if ret_rayheader.metadatasize > 0:
@@ -5,23 +5,28 @@ from .volumesweep import SweepHeader, MomentInfo
 from .volumesweep import  RayHeader
 from .volumesweep import BatchInfo
 from .msx_serializer import MSxSerializer
+
+#precompiled structures of the fixed size records of the v2 format
+_SWEEP_HEADER = struct.Struct("=4sB3BI16s16sfffBBBBBB2BHHffffI")
+_MOMENT_INFO = struct.Struct("=IBBBB12s12sfffB3B")
+_RAY_HEADER = struct.Struct("=IIIHHIfQIIH6B")
+_BATCH_INFO = struct.Struct("=IffHHf")
         
 class MSxV2Serializer(MSxSerializer):
     def __init__(self):
         super().__init__()
+        #preallocated buffer filled with readinto by each ray header read
+        self._ray_header_buf = bytearray(_RAY_HEADER.size)
         
     def read_sweep_header(self, f):
         ret_sweepheader = SweepHeader()
         
-        fmt = "=4sB3BI16s16sfffBBBBBB2BHHffffI"
-        struct_len = struct.calcsize(fmt)
-        data = f.read(struct_len)
+        data = f.read(_SWEEP_HEADER.size)
         if not data:
             f.close()
             self.eof = True
             raise Exception("Error reading sweep header")
-        s = struct.Struct(fmt)
-        unpacked_data = s.unpack(data)
+        unpacked_data = _SWEEP_HEADER.unpack(data)
         
         ret_sweepheader.fileid = unpacked_data[0]
         ret_sweepheader.version = unpacked_data[1]
@@ -48,16 +53,15 @@ class MSxV2Serializer(MSxSerializer):
         ret_sweepheader.metadatasize = unpacked_data[25]
         
         #read moments information
-        fmt = "=IBBBB12s12sfffB3B"
-        struct_len = struct.calcsize(fmt)
-        s = struct.Struct(fmt)
+        #all the moment info structures are read at once and then
+        #unpacked one by one from the same buffer
+        data = f.read(ret_sweepheader.nummoments * _MOMENT_INFO.size)
+        if len(data) < ret_sweepheader.nummoments * _MOMENT_INFO.size:
+            f.close()
+            self.eof = True
+            raise Exception("Error reading moment info structure")
         for i in range(ret_sweepheader.nummoments):
-            data = f.read(struct_len)
-            if not data:
-                f.close()
-                self.eof = True
-                raise Exception("Error reading moment info structure")
-            unpacked_data = s.unpack(data)
+            unpacked_data = _MOMENT_INFO.unpack_from(data, i * _MOMENT_INFO.size)
             
             mom_info = MomentInfo()
             mom_info.momentid = unpacked_data[0]
@@ -92,51 +96,35 @@ class MSxV2Serializer(MSxSerializer):
         return ret_sweepheader
         
     def read_ray_header(self, f):
-        ret_rayheader = RayHeader()
-        
-        fmt = "=IIIHHIfQIIH6B"
-        struct_len = struct.calcsize(fmt)
-        data = f.read(struct_len)
-        if not data:
+        data = self._ray_header_buf
+        read = f.readinto(data)
+        if not read:
             self.eof = True
             return None
-        s = struct.Struct(fmt)
-        unpacked_data = s.unpack(data)
+        if read < _RAY_HEADER.size:
+            f.close()
+            self.eof = True
+            raise Exception("Error reading ray header")
+        unpacked_data = _RAY_HEADER.unpack(data)
         
-        ret_rayheader.length = unpacked_data[0]
-        ret_rayheader.startangle = unpacked_data[1]
-        ret_rayheader.endangle = unpacked_data[2]
-        ret_rayheader.sequence = unpacked_data[3]
-        ret_rayheader.numpulses = unpacked_data[4]
-        ret_rayheader.databytes = unpacked_data[5]
-        ret_rayheader.prf = unpacked_data[6]
-        ret_rayheader.datetime = unpacked_data[7]
-        ret_rayheader.dataflags = unpacked_data[8]
-        ret_rayheader.metadatasize = unpacked_data[9]
-        ret_rayheader.numbatches = unpacked_data[10]
-        #unpacked_data[11], 12, 13, 14, 15 and 16 are spare
+        #unpacked fields from length to numbatches are in the same order
+        #of the RayHeader constructor, unpacked_data[11], 12, 13, 14, 15
+        #and 16 are spare
+        ret_rayheader = RayHeader(*unpacked_data[:11])
         
         #read batches information
-        fmt = "=IffHHf"
-        struct_len = struct.calcsize(fmt)
-        s = struct.Struct(fmt)
+        #all the batch info structures are read at once and then
+        #unpacked one by one from the same buffer
+        data = f.read(ret_rayheader.numbatches * _BATCH_INFO.size)
+        if len(data) < ret_rayheader.numbatches * _BATCH_INFO.size:
+            f.close()
+            self.eof = True
+            raise Exception("Error reading batch info structure")
         for i in range(ret_rayheader.numbatches):
-            data = f.read(struct_len)
-            if not data:
-                f.close()
-                self.eof = True
-                raise Exception("Error reading batch info structure")
-            unpacked_data = s.unpack(data)
-            
-            batch_info = BatchInfo()
-            batch_info.length = unpacked_data[0]
-            batch_info.startrange = unpacked_data[1]
-            batch_info.prf = unpacked_data[2]
-            batch_info.numpulses = unpacked_data[3]
-            batch_info.dprf = unpacked_data[4]
-            batch_info.angperc = unpacked_data[5]
-            
-            ret_rayheader.batchesinfo.append(batch_info)
+            #unpacked fields are length, startrange, prf, numpulses, dprf
+            #and angperc, in the same order of the BatchInfo constructor
+            ret_rayheader.batchesinfo.append(
+                BatchInfo(*_BATCH_INFO.unpack_from(data, i * _BATCH_INFO.size)))
         
         #read ray metadata
         if ret_rayheader.metadatasize > 0:
@@ -4,8 +4,9 @@ from typing import List
 import math
 import numpy as np
 
-from .volumesweep import PolarSweep, PolarSweepInfo, MomentInfo, MomentUUid
+from .volumesweep import PolarSweep, PolarSweepInfo, MomentInfo, MomentUUid, Ray
 from .cmd_line_params import MapSizeRect
+from .product_data import _polar2rect_indices
 
 class PolarPpiData:
     _SIZE = 360
@@ -15,6 +16,10 @@ class PolarPpiData:
         self._mom_id = 0
         self._norm = False
         self._mult = float("nan")
+        #the matrix preallocated here (or passed as data) is filled in place
+        #by the first transform, as long as it has not been handed out
+        #through data or get_ray before
+        self.__owns_data = num_gates != 0
         
         if num_gates == 0:
             self._num_rays = 0
@@ -45,6 +50,7 @@ class PolarPpiData:
         
     @property
     def data(self) -> np.ndarray:
+        self.__owns_data = False
         return self._data
     
     @data.setter
@@ -60,9 +66,11 @@ class PolarPpiData:
         self._norm = False
         self._mult = float("nan")
         self._num_rays = PolarPpiData._SIZE
+        self.__owns_data = False
         self._data = value
         
     def get_ray(self, index: int):
+        self.__owns_data = False
         return self._data[index]
         
     def transform(self, sweep: PolarSweep, mom_id: int=None, mom_name: str=None):
@@ -94,52 +102,113 @@ class PolarPpiData:
         self._norm = self.__detect_norm(sweep_info, mom_info)
         self._mult = self._norm if self.__detect_mult(sweep_info, mom_info) else float("nan")
         
-        #initialize internal matrix to all nan
-        self._data = np.full((self._SIZE, self._num_gates), np.nan)
+        #allocate internal matrix without initializing it, only the rows
+        #not covered by any ray are set to nan at the end of this method.
+        #A matrix of the right shape preallocated by the constructor is
+        #filled in place, matrices already handed out to the caller (e.g.
+        #by a previous transform) are never overwritten
+        if (not self.__owns_data or self._data.shape != (self._SIZE, self._num_gates) or
+                self._data.dtype != np.float64 or not self._data.flags.writeable or
+                not self._data.flags.c_contiguous):
+            self._data = np.empty((self._SIZE, self._num_gates))
+        self.__owns_data = False
         
-        #inizialite buff to check for empty slots (used later in this method to prevent holes)
-        buff: List[int] = [0] * self._SIZE
+        #azimuth ranges of all the rays, computed at once before the loop
+        az_starts, az_stops = self.__rays_az_ranges(sweep)
         
-        #for each ray of sweep
-        for i in range(len(sweep.rays)):
-            ray = sweep.rays[i]
-            mom = ray.get_moment_by_id(self._mom_id)
-            if mom is None:
-                continue
-                
-            az_start: int = int(0.5 + ray.get_startaz_deg())
-            az_stop: int = int(0.5 + ray.get_endaz_deg())
-            if az_stop < az_start:
-                if az_stop < (az_start - 10):
-                    az_stop += 360
-                else:
-                    tmp = az_start
-                    az_start = az_stop
-                    az_stop = tmp
-            elif az_start < az_stop:
-                if az_stop > 355 and az_start < 5:
-                    az_start += 360
-                    tmp = az_start
-                    az_start = az_stop
-                    az_stop = tmp
-                    
-            for j in range(az_start, az_stop+1):
-                az = j
+        #real values of every ray, the same row is then copied for every
+        #azimuth covered by the ray
+        matrix, has_mom = self.__materialize_rays(sweep)
+        
+        size = self._SIZE
+        
+        if az_starts == az_stops:
+            #fast path, every ray covers a single azimuth: there is nothing
+            #to wrap and the hole correction only keeps the first ray
+            #assigned to each azimuth, that is the first occurrence of
+            #each azimuth among the rays with the moment
+            rays = np.flatnonzero(has_mom)
+            azimuths, first = np.unique(np.array(az_starts)[rays] % size, return_index=True)
+            az_ray = np.full(size, -1)
+            az_ray[azimuths] = rays[first]
+        else:
+            #inizialite buff to check for empty slots (used later in this method to prevent holes),
+            #only whether a slot has been filled matters so a flag byte per azimuth is enough
+            buff = bytearray(size)
+            
+            #ray assigned to each azimuth (-1 if none), the loop below only
+            #does the azimuth bookkeeping and the rows are copied at the end
+            az_ray = [-1] * size
+            
+            #for each ray of sweep
+            for i in range(len(has_mom)):
+                if not has_mom[i]:
+                    continue
                 
-                #make some adjustments to 'az'
-                if az > 359:
-                    az -= 360
-                elif az < 0:
-                    az += 360
+                az_start: int = az_starts[i]
+                az_stop: int = az_stops[i]
+            
+                #azimuths covered by the ray, wrapped around into 0..359
+                az_indices = [j % size for j in range(az_start, az_stop+1)]
+            
+                #correction to prevent holes: the last azimuth of the ray is
+                #not overwritten if it has already been filled
+                if az_indices and buff[az_indices[-1]]:
+                    az_indices.pop()
                 
-                #correction to prevent holes
-                if j == az_stop and buff[az] != 0:
-                   continue;
-                buff[az] += 1
+                for az in az_indices:
+                    buff[az] = 1
                 
-                #copy the value in the internal matrix at the index 'az' 'k'
-                for k in range(self._num_gates):
-                    self._data[az][k] = mom.get_real_value(mom_info, k) * self._mult if self._norm else mom.get_real_value(mom_info, k)
+                    #assign the ray to the index 'az'
+                    az_ray[az] = i
+            
+            az_ray = np.array(az_ray)
+        
+        #copy the rows of the rays in the internal matrix with a single
+        #assignment and set to nan the rows not filled by any ray
+        filled = az_ray >= 0
+        self._data[filled] = matrix[az_ray[filled]]
+        self._data[~filled] = np.nan
+        
+    def __materialize_rays(self, sweep: PolarSweep):
+        #returns the matrix of the real values of the current moment for
+        #every ray of the sweep, already multiplied by the moment multiplier
+        #when the moment is normalized, and the list of flags telling which
+        #rays actually have that moment
+        mom_id = self._mom_id
+        
+        #all the rays are converted at once, with the number of gates of
+        #the first ray
+        matrix = sweep.get_moment_matrix(mom_id, self._num_gates)
+        if self._norm:
+            matrix *= self._mult
+            
+        return matrix, [ray.get_moment_by_id(mom_id) is not None for ray in sweep.rays]
+        
+    def __rays_az_ranges(self, sweep: PolarSweep):
+        #returns the lists of the first and last azimuth (rounded to the
+        #nearest degree) of every ray of the sweep, after the adjustments
+        #for rays crossing the north and for rays with reversed angles
+        start_angles = np.array([ray.rayheader.startangle for ray in sweep.rays], dtype=np.int64)
+        stop_angles = np.array([ray.rayheader.endangle for ray in sweep.rays], dtype=np.int64)
+        az_start = (0.5 + Ray.get_az_deg(start_angles)).astype(np.int64)
+        az_stop = (0.5 + Ray.get_az_deg(stop_angles)).astype(np.int64)
+
+        #rays going backwards: if they cross the north the stop is moved
+        #after 360, otherwise start and stop are swapped
+        backward = az_stop < az_start
+        backward_north = backward & (az_stop < (az_start - 10))
+        backward_swap = backward & ~backward_north
+        #rays going forward crossing the north: the start is moved after
+        #360 and then swapped with the stop
+        forward_north = (az_start < az_stop) & (az_stop > 355) & (az_start < 5)
+
+        ret_start = np.where(backward_swap | forward_north, az_stop, az_start)
+        ret_stop = np.where(backward_swap, az_start,
+            np.where(forward_north, az_start + 360,
+            np.where(backward_north, az_stop + 360, az_stop)))
+
+        return ret_start.tolist(), ret_stop.tolist()
         
     def init_from(self):
         pass
@@ -176,74 +245,97 @@ class PolarPpiData:
         
         output = np.full((size.y_size, size.x_size), np.nan)
         
+        #bind functions and data to locals, they are used for every pixel
+        sqrt = math.sqrt
+        atan2 = math.atan2
+        data = self._data
+        
         for j in range(size.y_size):
             y = j -radar_y0
+            #the y term and the output row are the same for the whole row
+            y_term = y * y * y_res
+            output_row = output[j]
             for i in range(size.x_size):
                 x = i - radar_x0
-                r = math.sqrt(x * x * x_res + y * y * y_res) #in km
+                r = sqrt(x * x * x_res + y_term) #in km
                 irng = int(r / gate_width + 0.5)
                 if irng < num_gates:
-                    azimuth = 57.2957795 * math.atan2(x, y)
+                    azimuth = 57.2957795 * atan2(x, y)
                     iaz = 180 - int(azimuth)
-                    output[j][i] = self._data[iaz][irng]
+                    output_row[i] = data[iaz, irng]
         
         return output
         
     def __polar2rect_vectorized(self, gate_width: float, size: MapSizeRect=None) -> np.ndarray:
-        if size is None:
-            x_y_size: int = self.num_gates * 2
-            size = MapSizeRect(x_y_size, x_y_size, gate_width, gate_width)
-
-        x_res: float = size.x_res
-        y_res: float = size.y_res
-
-        radar_x0: float = (size.x_size - 1) * 0.5
-        radar_y0: float = (size.y_size - 1) * 0.5
-
-        num_gates: int = self.num_gates
-
-        output = np.full((size.y_size, size.x_size), np.nan)
+        return PolarPpiData.polar2rect_batch([self._data], gate_width, size)[0]
 
-        # Create meshgrid for x and y coordinates
-        y_indices, x_indices = np.meshgrid(np.arange(size.y_size), np.arange(size.x_size), indexing='ij')
-        x = (x_indices - radar_x0) * x_res
-        y = (y_indices - radar_y0) * y_res
+    #converts several polar data matrices (360 rays x num_gates each, all with
+    #the same number of gates, e.g. the moments of the same sweep) into rects
+    #with the same geometry at once, the geometry is computed only once.
+    #Returns an array with shape (len(datas), y_size, x_size), if size is not
+    #specified or is None it is auto determined as in polar2rect
+    @staticmethod
+    def polar2rect_batch(datas: List[np.ndarray], gate_width: float, size: MapSizeRect=None) -> np.ndarray:
+        if len(datas) == 0:
+            raise ValueError("at least one polar data matrix must be specified")
+        num_gates: int = datas[0].shape[1]
+        for data in datas:
+            if data.shape != (PolarPpiData._SIZE, num_gates):
+                raise ValueError("all polar data matrices must have shape (%d, %d)" %
+                    (PolarPpiData._SIZE, num_gates))
 
-        # Calculate r and azimuth in vectorized form
-        r = np.sqrt(x * x + y * y)  # in km
-        irng = (r / gate_width + 0.5).astype(int)
+        if size is None:
+            x_y_size: int = num_gates * 2
+            size = MapSizeRect(x_y_size, x_y_size, gate_width, gate_width)
 
-        # Calculate azimuth and convert to array index
-        azimuth = np.degrees(np.arctan2(x, y))
-        iaz = 180 - azimuth.astype(int)
+        # The output keeps the precision of the data (float32 data gives a
+        # float32 rect), but it is always a floating point type to hold nan.
+        # It is not initialized, the gather below writes every pixel
+        output = np.empty((len(datas), size.y_size, size.x_size),
+            dtype=np.result_type(*[data.dtype for data in datas], np.float32))
 
-        # Create mask for valid indices
-        valid_mask = (irng < num_gates) & (iaz >= 0) & (iaz < 360)
+        # Indices depend only on the geometry, they are computed once and
+        # cached, so that each call only gathers the data
+        indices = _polar2rect_indices(size.x_size, size.y_size,
+            size.x_res, size.y_res, gate_width, num_gates)
 
-        # Populate the output array
-        output[valid_mask] = self._data[iaz[valid_mask], irng[valid_mask]]
+        # Populate the output arrays with a single gather each, the pixels
+        # out of range take the nan appended after the polar data
+        for i in range(len(datas)):
+            source = np.append(datas[i], np.nan).astype(output.dtype, copy=False)
+            source.take(indices, out=output[i])
 
         return output
-    
+
     def __detect_norm(self, sweep_info: PolarSweepInfo, mom_info: MomentInfo) -> bool:
-        if mom_info.momentid in [MomentUUid.W, MomentUUid.W_V]:
-            return sweep_info.is_width_normalized()
-        elif mom_info.momentid in [MomentUUid.V, MomentUUid.V_V,
-                MomentUUid.V_PPP, MomentUUid.V_PPP_V]:
-            return sweep_info.is_velocity_normalized()
-        elif mom_info.momentid in [MomentUUid.PHIDP, MomentUUid.PHIDP_F]:
-            return sweep_info.is_phidp_normalized()
-        else:
-            return False
+        detector = PolarPpiData.__NORM_DETECTORS.get(mom_info.momentid)
+        return detector(sweep_info) if detector is not None else False
         
     def __detect_mult(self, sweep_info: PolarSweepInfo, mom_info: MomentInfo) -> float:
-        if mom_info.momentid in [MomentUUid.W, MomentUUid.W_V]:
-            return sweep_info.get_width_nyquist()
-        elif mom_info.momentid in [MomentUUid.V, MomentUUid.V_V,
-                MomentUUid.V_PPP, MomentUUid.V_PPP_V]:
-            return sweep_info.get_velocity_nyquist()
-        elif mom_info.momentid in [MomentUUid.PHIDP, MomentUUid.PHIDP_F]:
-            return sweep_info.get_phidp_phase()
-        else:
-            return 1
+        detector = PolarPpiData.__MULT_DETECTORS.get(mom_info.momentid)
+        return detector(sweep_info) if detector is not None else 1
+    
+    #normalization flag and multiplier getters of the sweep info for each
+    #normalized moment, built once when the class is created
+    __NORM_DETECTORS = {
+        MomentUUid.W: PolarSweepInfo.is_width_normalized,
+        MomentUUid.W_V: PolarSweepInfo.is_width_normalized,
+        MomentUUid.V: PolarSweepInfo.is_velocity_normalized,
+        MomentUUid.V_V: PolarSweepInfo.is_velocity_normalized,
+        MomentUUid.V_PPP: PolarSweepInfo.is_velocity_normalized,
+        MomentUUid.V_PPP_V: PolarSweepInfo.is_velocity_normalized,
+        MomentUUid.PHIDP: PolarSweepInfo.is_phidp_normalized,
+        MomentUUid.PHIDP_F: PolarSweepInfo.is_phidp_normalized,
+    }
+    
+    __MULT_DETECTORS = {
+        MomentUUid.W: PolarSweepInfo.get_width_nyquist,
+        MomentUUid.W_V: PolarSweepInfo.get_width_nyquist,
+        MomentUUid.V: PolarSweepInfo.get_velocity_nyquist,
+        MomentUUid.V_V: PolarSweepInfo.get_velocity_nyquist,
+        MomentUUid.V_PPP: PolarSweepInfo.get_velocity_nyquist,
+        MomentUUid.V_PPP_V: PolarSweepInfo.get_velocity_nyquist,
+        MomentUUid.PHIDP: PolarSweepInfo.get_phidp_phase,
+        MomentUUid.PHIDP_F: PolarSweepInfo.get_phidp_phase,
+    }
 
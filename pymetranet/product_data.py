@@ -1,10 +1,55 @@
 #!/bin/env python3
 
 import math
+import functools
 from abc import ABC, abstractmethod
+from typing import List
 import numpy as np
 from .cmd_line_params import MapSizeRect
 
+@functools.lru_cache(maxsize=16)
+def _polar2rect_indices(x_size: int, y_size: int, x_res: float, y_res: float,
+        gate_width: float, num_gates: int) -> np.ndarray:
+    #returns the (y_size, x_size) matrix of the flat indices into the
+    #(num_rays, num_gates) polar data of each pixel of the rect, -1 for
+    #the pixels out of range. The geometry is shared by all the polar to
+    #rect conversions (of ProductDataRect and PolarPpiData), the returned
+    #array is shared between calls and is read only
+    radar_x0: float = (x_size - 1) * 0.5
+    radar_y0: float = (y_size - 1) * 0.5
+
+    # x coordinates as a row and y coordinates as a column, broadcasting
+    # expands them to the full grid without materializing index matrices
+    x = ((np.arange(x_size) - radar_x0) * x_res).reshape(1, -1)
+    y = ((np.arange(y_size) - radar_y0) * y_res).reshape(-1, 1)
+
+    # Calculate r and azimuth in vectorized form, the same full size
+    # buffer is updated in place to limit the number of temporaries
+    buff = x * x + y * y
+    np.sqrt(buff, out=buff)  # in km
+    buff /= gate_width
+    buff += 0.5
+    irng = buff.astype(int)
+
+    # Calculate azimuth (reusing the buffer) and convert to array index
+    azimuth = np.arctan2(x, y, out=buff)
+    np.degrees(azimuth, out=azimuth)
+    iaz = azimuth.astype(int)
+    np.subtract(180, iaz, out=iaz)
+
+    # Create mask for valid indices, azimuth is in [-180, 180] so iaz is
+    # never negative and only iaz == 360 (azimuth of exactly -180) must
+    # be excluded
+    valid_mask = (irng < num_gates) & (iaz < 360)
+
+    # Single flat gather index per pixel, int32 is enough for
+    # num_rays * num_gates and halves the size of the cached indices
+    indices = np.full(valid_mask.shape, -1, dtype=np.int32)
+    indices[valid_mask] = iaz[valid_mask] * num_gates + irng[valid_mask]
+    indices.flags.writeable = False
+
+    return indices
+
 class ProductData(ABC):
     def __init__(self) -> None:
         self._data: np.ndarray = None
@@ -51,11 +96,23 @@ class ProductDataPolar(ProductData):
             assert data.ndim == 1 or data.ndim == 2
             assert data.size == num_rays * num_gates
             if data.ndim == 1:
-                self.data = data.reshape(num_rays, num_gates)
+                #1d data is contiguous after ascontiguousarray, so reshape
+                #always returns a view and never makes a further copy
+                self._data = np.ascontiguousarray(data).reshape(num_rays, num_gates)
             elif data.ndim == 2:
                 assert data.shape[0] == num_rays and data.shape[1] == num_gates
                 self._data = data
 
+    @classmethod
+    def from_flat(cls, num_rays: int, num_gates: int, data: np.ndarray) -> "ProductDataPolar":
+        #builds the object from data of any shape holding num_rays * num_gates
+        #values with a single reshape and without the checks of the constructor
+        #(reshape still raises ValueError if the size doesn't match), for bulk
+        #construction of many products from trusted buffers
+        ret = cls(num_rays, num_gates)
+        ret._data = np.asarray(data).reshape(num_rays, num_gates)
+        return ret
+
     @property
     def num_rays(self) -> int:
         return self._num_rays
@@ -75,6 +132,9 @@ class ProductDataPolar(ProductData):
 class ProductDataRect(ProductData):
     def __init__(self, x_size: int, y_size: int, x_res: float, y_res: float, data: np.ndarray=None) -> None:
         super().__init__()
+        #the output of polar2rect is filled in place only in an array this
+        #object allocated itself and has not handed out through data yet
+        self.__owns_data = False
 
         self._size: MapSizeRect = MapSizeRect(x_size, y_size, x_res, y_res)
 
@@ -89,10 +149,33 @@ class ProductDataRect(ProductData):
             assert data.ndim == 1 or data.ndim == 2
             assert data.size == x_size * y_size
             if data.ndim == 1:
-                self.data = data.reshape(y_size, x_size)
+                #1d data is contiguous after ascontiguousarray, so reshape
+                #always returns a view and never makes a further copy
+                self._data = np.ascontiguousarray(data).reshape(y_size, x_size)
             elif data.ndim == 2:
                 assert data.shape[0] == y_size and data.shape[1] == x_size
                 self._data = data
+
+    @classmethod
+    def from_flat(cls, x_size: int, y_size: int, x_res: float, y_res: float,
+            data: np.ndarray) -> "ProductDataRect":
+        #builds the object from data of any shape holding x_size * y_size
+        #values with a single reshape and without the checks of the constructor
+        #(reshape still raises ValueError if the size doesn't match), for bulk
+        #construction of many products from trusted buffers
+        ret = cls(x_size, y_size, x_res, y_res)
+        ret._data = np.asarray(data).reshape(y_size, x_size)
+        return ret
+    
+    @property
+    def data(self) -> np.ndarray:
+        self.__owns_data = False
+        return self._data
+    
+    @data.setter
+    def data(self, value: np.ndarray) -> None:
+        self.__owns_data = False
+        self._data = value
     
     @property
     def num_rows(self) -> int:
@@ -102,6 +185,9 @@ class ProductDataRect(ProductData):
     def num_cols(self) -> int:
         return self._size.x_size
     
+    #fills the data of this rect converting polar with its geometry. Arrays
+    #passed to the constructor or already obtained through data are never
+    #overwritten, a new array is allocated for them
     def polar2rect(self, polar: ProductDataPolar, gate_width: float, vectorized: bool=True) -> None:
         if vectorized:
             self.__polar2rect_vectorized(polar, gate_width)
@@ -109,56 +195,86 @@ class ProductDataRect(ProductData):
             self.__polar2rect(polar, gate_width)
         
     def __polar2rect(self, polar: ProductDataPolar, gate_width: float) -> None:
+        #unpack the size once, its fields are read below as plain locals
+        x_size: int = self._size.x_size
+        y_size: int = self._size.y_size
         x_res: float = self._size.x_res * self._size.x_res
         y_res: float = self._size.y_res * self._size.y_res
         
-        radar_x0: float = (self._size.x_size - 1) * 0.5
-        radar_y0: float = (self._size.y_size - 1) * 0.5
+        radar_x0: float = (x_size - 1) * 0.5
+        radar_y0: float = (y_size - 1) * 0.5
 
         num_gates: int = polar.num_gates
         
-        self._data = np.full((self._size.y_size, self._size.x_size), 0, dtype=np.uint8)
+        self.__ensure_output()
+        self._data.fill(0)
+        
+        #bind functions and data to locals, they are used for every pixel
+        sqrt = math.sqrt
+        atan2 = math.atan2
+        polar_data = polar._data
         
-        for j in range(self._size.y_size):
+        for j in range(y_size):
             y = j -radar_y0
-            for i in range(self._size.x_size):
+            #the y term and the output row are the same for the whole row
+            y_term = y * y * y_res
+            output_row = self._data[j]
+            for i in range(x_size):
                 x = i - radar_x0
-                r = math.sqrt(x * x * x_res + y * y * y_res) #in km
+                r = sqrt(x * x * x_res + y_term) #in km
                 irng = int(r / gate_width + 0.5)
                 if irng < num_gates:
-                    azimuth = 57.2957795 * math.atan2(x, y)
+                    azimuth = 57.2957795 * atan2(x, y)
                     iaz = 180 - int(azimuth)
-                    self._data[j, i] = polar._data[iaz, irng]
+                    output_row[i] = polar_data[iaz, irng]
 
     def __polar2rect_vectorized(self, polar: ProductDataPolar, gate_width: float) -> None:
-        x_res: float = self._size.x_res
-        y_res: float = self._size.y_res
-
-        radar_x0: float = (self._size.x_size - 1) * 0.5
-        radar_y0: float = (self._size.y_size - 1) * 0.5
+        # Indices depend only on the geometry, they are computed once and
+        # cached, so that converting several polar products on the same
+        # grid only gathers the data
+        size = self._size
+        indices = _polar2rect_indices(size.x_size, size.y_size,
+            size.x_res, size.y_res, gate_width, polar.num_gates)
 
-        num_gates: int = polar.num_gates
-
-        self._data = np.full((self._size.y_size, self._size.x_size), 0, dtype=np.uint8)
+        # Populate the output array with a single gather, the pixels out of
+        # range take the 0 appended after the polar data
+        source = np.append(polar._data, 0).astype(np.uint8, copy=False)
+        source.take(indices, out=self.__ensure_output())
 
-        # Create meshgrid for x and y coordinates
-        y_indices, x_indices = np.meshgrid(np.arange(self._size.y_size), np.arange(self._size.x_size), indexing='ij')
-        x = (x_indices - radar_x0) * x_res
-        y = (y_indices - radar_y0) * y_res
+    #converts several polar products (all with the same number of rays and
+    #gates, e.g. a time series of sweeps) with the geometry of this rect at
+    #once, the data of this rect is not modified. Returns an uint8 array with
+    #shape (len(polars), y_size, x_size)
+    def polar2rect_batch(self, polars: List[ProductDataPolar], gate_width: float) -> np.ndarray:
+        if len(polars) == 0:
+            raise ValueError("at least one polar product must be specified")
+        shape = polars[0]._data.shape
+        for polar in polars:
+            if polar._data.shape != shape:
+                raise ValueError("all polar products must have shape (%d, %d)" % shape)
 
-        # Calculate r and azimuth in vectorized form
-        r = np.sqrt(x * x + y * y)  # in km
-        irng = (r / gate_width + 0.5).astype(int)
+        size = self._size
+        indices = _polar2rect_indices(size.x_size, size.y_size,
+            size.x_res, size.y_res, gate_width, shape[1])
 
-        # Calculate azimuth and convert to array index
-        azimuth = np.degrees(np.arctan2(x, y))
-        iaz = 180 - azimuth.astype(int) 
+        # Polar data stacked one product per row, followed by the 0 taken
+        # by the pixels out of range, all the rects are then gathered at once
+        source = np.zeros((len(polars), shape[0] * shape[1] + 1), dtype=np.uint8)
+        for i, polar in enumerate(polars):
+            source[i, :-1] = polar._data.reshape(-1)
 
-        # Create mask for valid indices
-        valid_mask = (irng < num_gates) & (iaz >= 0) & (iaz < 360)
+        return source.take(indices, axis=1)
 
-        # Populate the output array
-        self._data[valid_mask] = polar._data[iaz[valid_mask], irng[valid_mask]]
+    def __ensure_output(self) -> np.ndarray:
+        #the rect matrix left by a previous polar2rect is reused and
+        #overwritten in place as long as it has not been handed out,
+        #otherwise a new one is allocated without initializing it
+        shape = (self._size.y_size, self._size.x_size)
+        if not self.__owns_data or self._data.shape != shape:
+            self._data = np.empty(shape, dtype=np.uint8)
+            self.__owns_data = True
+        
+        return self._data
 
 class ProductDataVertLevels(ProductData):
     def __init__(self, num_floats32: int, num_levels: int, data: np.ndarray=None) -> None:
@@ -186,7 +302,7 @@ class ProductDataVertLevels(ProductData):
         else:
             assert data.ndim == 1
             assert data.size == num_floats32 * 4 * num_levels
-            self.data = data
+            self._data = data
     
     @property
     def num_floats32(self) -> int:
@@ -196,11 +312,13 @@ class ProductDataVertLevels(ProductData):
     def num_levels(self) -> int:
         return self._num_levels
 
+    #logically each level is a row whose columns are the bytes of its float32
+    #values, so that num_rows * num_cols is the size in bytes of the data
     @property
     def num_rows(self) -> int:
-        return len(self._data.shape)
+        return self._num_levels
 
     @property
     def num_cols(self) -> int:
-        return len(self._size)
+        return self._num_floats32 * 4
 
@@ -1,10 +1,31 @@
 #!/bin/env python3
 
+import os
+import mmap
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from enum import IntEnum
 from typing import List
 import numpy as np
 from .product_data import ProductData, ProductDataPolar, ProductDataRect, ProductDataVertLevels
-from .lzw15 import decompress as lzw15_decompress, compress as lzw15_compress
+from .lzw15 import decompress_into as lzw15_decompress_into, compresstobytes as lzw15_compresstobytes
+
+#rows of data compressed in each tile of tiled products
+TILE_ROWS = 256
+
+def _compress_tiles(data: np.ndarray, tile_rows: int = TILE_ROWS, workers: int = None) -> List[bytes]:
+    #tiles are bands of rows compressed independently, each with its own
+    #lzw15 codebook. They are compressed in parallel by worker processes
+    #only when more than one worker is asked for: starting a process pool
+    #(which may re-import the __main__ module) and pickling the tiles both
+    #ways is worth it only for large products
+    tiles = [np.ascontiguousarray(data[row:row + tile_rows]) for row in range(0, data.shape[0], tile_rows)]
+    if workers is None or workers <= 1 or len(tiles) <= 1:
+        return [lzw15_compresstobytes(tile) for tile in tiles]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lzw15_compresstobytes, tiles))
 
 class ProductTable:
     def __init__(self, name: str=None, size: int = 0, data=None) -> None:
@@ -44,11 +65,32 @@ class ProductDataType(IntEnum):
     #Vad, Vvp, Rhi, etc...
 
 class ProductFile:
+    #vad, vvp and vpr products are recognized by the first two characters
+    #of the pid or by their format, the others only by their format
+    __VERT_LEVELS_PIDS = ("VA", "VV", "ZZ")
+    __VERT_LEVELS_FORMATS = ("VADSTR", "VVPSTR")
+    __FORMAT_DATA_TYPES = {
+        "RECT": ProductDataType.Rect,
+        "STORM": ProductDataType.Rect,
+        "POLAR": ProductDataType.Polar,
+    }
+    #numbered keys ('table_name2', 'param_value3', ...) are saved without number
+    __SAVE_KEY_PREFIXES = ("table_name", "table_size", "param_name", "param_value")
+    #header values needed to decode and shape the data read from file
+    __DATA_KEYS = ("compression", "tiled", "compressed_tile_sizes", "row", "column", "rect_xres", "rect_yres")
+
     def __init__(self) -> None:
         self._data_type: ProductDataType = ProductDataType.Unknown
         self._data: ProductData = None
+        #data read by a lazy load_file, not yet decompressed
+        self.__pending_data = None
+        #(device, inode) of the file the data is memory mapped from, if any
+        self.__mapped_file_id = None
         self._file_name: str = None
         self._header_info: list = []
+        #index of the entries of _header_info by name, _header_info keeps
+        #the order of the entries and the index shares the same [name, value]
+        self._header_index: dict = {}
         self._tables: List[ProductTable] = []
         self._error_descr = None
 
@@ -58,33 +100,48 @@ class ProductFile:
     
     @property
     def data(self) -> ProductData:
+        if self.__pending_data is not None:
+            self.__load_pending_data()
         return self._data
 
     @data.setter
     def data(self, value: ProductData) -> None:
+        self.__pending_data = None
         self._data = value
     
-    def load_file(self, file_name: str) -> None:
+    def load_file(self, file_name: str, memory_map: bool = False, lazy: bool = False) -> None:
         self._file_name = file_name
 
         #cleanup internal data
         self._data_type = ProductDataType.Unknown
         self._header_info.clear()
+        self._header_index.clear()
         self._tables.clear()
         self._data = None
-
-        #read product line by line until line 'end_header' is reached
-        line: str = ""
-        f = open(self._file_name, "rb")
-        try:
-            while line != "end_header":
-                line = f.readline().decode("utf-8")
-                line = line.rstrip()
-                index = line.find("=")
-                if index != -1:
-                    name = line[0:index]
-                    value = line[index+1:]
-
+        self.__pending_data = None
+        self.__mapped_file_id = None
+
+        #the text header is located in a memory mapping of the file and
+        #decoded at once, then split line by line. With memory_map the
+        #mapping is copy on write, so that uncompressed data can be used
+        #in place, writable, without ever changing the file
+        with open(self._file_name, "rb") as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY if memory_map else mmap.ACCESS_READ)
+            except ValueError:
+                #empty files can't be mapped
+                mapping = b""
+            header_size: int = ProductFile.__find_header_size(mapping)
+            if header_size < 0:
+                raise IOError("unexpected eof found while reading text header")
+            header_text: str = mapping[:header_size].decode("utf-8")
+
+            #continue reading binary data after the header
+            f.seek(header_size)
+
+            for line in header_text.split("\n"):
+                name, separator, value = line.rstrip().partition("=")
+                if separator:
                     #search in _header_info if this key already exists
                     #if it exists saerch in a loop if there is a key with the name
                     #adding an incremental counter at the end of the name.
@@ -94,79 +151,78 @@ class ProductFile:
                     #'the name 'table_name2', if it doesn't exist, add it as 'table_name2' as name.
                     #then we go forward with this logic with 'table_name3', 'table_name4' and so on...
                     key = self.__get_valid_key_name(name)
-                    self._header_info.append([key, value])
-        except EOFError as ex:
-            f.close()
-            raise IOError("unexpected eof found while reading text header")
+                    self.__append_header_info(key, value)
         
-        #set product data type
-        if self.__is_vad() or self.__is_vvp() or self.__is_vpr():
-            self._data_type = ProductDataType.VertLevels
-        else:
+            #set product data type, pid and format are looked up only once
+            pid = self.find_header_info_value("pid")
             format = self.find_header_info_value("format")
-            if format == "RECT" or format == "STORM":
-                self._data_type = ProductDataType.Rect
-            elif format == "POLAR":
-                self._data_type = ProductDataType.Polar
-
-        #read product tables
-        num_tables: int = int(self.find_header_info_value("table_num"))
-        for count in range(1, num_tables + 1):
-            key_table_name: str = "table_name" if count == 1 else "table_name" + str(count)
-            key_table_size: str = "table_size" if count == 1 else "table_size" + str(count)
-            table_name: str = self.find_header_info_value(key_table_name)
-            table_size: int = int(self.find_header_info_value(key_table_size))
-
-            #create a new empty product table inside _tables
-            table = ProductTable(table_name, table_size)
-
-            #read data from file into table
-            table.data = np.fromfile(f, np.uint8, table.size)
-
-            #add table to list of tables
-            self._tables.append(table)
-
-        #read data
-        zip_size: int = int(self.find_header_info_value("compressed_bytes"))
-        unzip_size: int = int(self.find_header_info_value("uncompressed_bytes"))
-        buff_size: int = zip_size if zip_size != 0 else unzip_size
-
-        #uncompress if necessary
-        if zip_size != 0 and zip_size != unzip_size:
-            buffer = f.read(buff_size)
-            ret_buffer_lzw15 = lzw15_decompress(buffer)
-            decoded = b"".join(ret_buffer_lzw15)
-            buffer = np.frombuffer(decoded, dtype=np.uint8)
+            if pid[:2] in self.__VERT_LEVELS_PIDS or format in self.__VERT_LEVELS_FORMATS:
+                self._data_type = ProductDataType.VertLevels
+            else:
+                self._data_type = self.__FORMAT_DATA_TYPES.get(format, ProductDataType.Unknown)
+
+            #header values are looked up through a local binding of the getter
+            header_value = self.find_header_info_value
+
+            #create product tables
+            num_tables: int = int(header_value("table_num"))
+            for count in range(1, num_tables + 1):
+                key_table_name: str = "table_name" if count == 1 else "table_name" + str(count)
+                key_table_size: str = "table_size" if count == 1 else "table_size" + str(count)
+                table_name: str = header_value(key_table_name)
+                table_size: int = int(header_value(key_table_size))
+
+                #create a new empty product table inside _tables
+                self._tables.append(ProductTable(table_name, table_size))
+
+            #size of data
+            zip_size: int = int(header_value("compressed_bytes"))
+            unzip_size: int = int(header_value("uncompressed_bytes"))
+            buff_size: int = zip_size if zip_size != 0 else unzip_size
+
+            #uncompressed data is used straight from the mapping when requested,
+            #pages are loaded on first access. The mapped file is remembered
+            #so that save_file never truncates it under the mapping
+            map_data: bool = (memory_map and isinstance(mapping, mmap.mmap) and
+                              (zip_size == 0 or zip_size == unzip_size))
+            if map_data:
+                stat = os.fstat(f.fileno())
+                self.__mapped_file_id = (stat.st_dev, stat.st_ino)
+            elif isinstance(mapping, mmap.mmap):
+                mapping.close()
+
+            #tables and data are read at once and then split, the arrays built on
+            #top of the buffer share it without copies and are writable
+            tables_size: int = sum(table.size for table in self._tables)
+            blob = bytearray(tables_size if map_data else tables_size + buff_size)
+            read_size: int = f.readinto(blob)
+            view = memoryview(blob)[:read_size]
+
+        #fill tables with their part of the buffer
+        offset: int = 0
+        for table in self._tables:
+            table.data = np.frombuffer(view[offset:offset + table.size], dtype=np.uint8)
+            offset += len(table.data)
+        if map_data:
+            offset += header_size
+            view = memoryview(mapping)
+        view = view[offset:offset + buff_size]
+
+        #with lazy the data is decompressed only on first access, callers
+        #that need only the header or the tables don't pay for it. The header
+        #values describing the data are taken now, the header may be changed
+        #before the data is accessed
+        data_values = {key: header_value(key) for key in self.__DATA_KEYS}
+        if lazy:
+            self.__pending_data = (view, zip_size, unzip_size, self._data_type, data_values)
         else:
-            buffer = np.fromfile(f, np.uint8, buff_size)
+            self.__build_data(view, zip_size, unzip_size, self._data_type, data_values)
 
-        #close the file
-        f.close()
+    def save_file(self, file_name: str, compress: bool=True, tile_rows: int=TILE_ROWS, workers: int=None) -> None:
+        #data of lazy loaded products is needed from here on
+        if self.__pending_data is not None:
+            self.__load_pending_data()
 
-        #reshape data read into a 2d matrix and store inside internal _data
-        if self._data_type == ProductDataType.Polar:
-            num_rays: int = int(self.find_header_info_value("row"))
-            num_gates: int = int(self.find_header_info_value("column"))
-            #create self._data as a ProductDataPolar object, here
-            #buffer is a 1D array but inside the constructor of ProductDataPolar
-            #it will be reshaped to be a 2D array with num_rays rows and num_gates cols
-            self._data = ProductDataPolar(num_rays, num_gates, buffer)
-        elif self._data_type == ProductDataType.Rect:
-            x: int = int(self.find_header_info_value("column"))
-            y: int = int(self.find_header_info_value("row"))
-            xres: float = float(self.find_header_info_value("rect_xres"))
-            yres: float = float(self.find_header_info_value("rect_yres"))
-            #create self._data as a ProductDataRect object, here
-            #buffer is a 1D array but inside the constructor of ProductDataRect
-            #it will be reshaped to be a 2D array with y rows and x cols
-            self._data = ProductDataRect(x, y, xres, yres, buffer)
-        elif self._data_type == ProductDataType.VertLevels:
-            num_floats32: int = int(self.find_header_info_value("row"))
-            num_levels: int = int(self.find_header_info_value("column"))
-            #create self._data as a ProductDataVertLevels
-            self._data = ProductDataVertLevels(num_floats32, num_levels, buffer)
-
-    def save_file(self, file_name: str, compress: bool=True) -> None:
         #compressed_bytes and uncompressed_bytes parameters must be present
         info_compressed = self.find_header_info("compressed_bytes")
         if info_compressed is None:
@@ -180,9 +236,29 @@ class ProductFile:
         zip_buff = None
         zip_size = 0
         if compress:
-            buff = self._data.data.tobytes()
-            compressed = lzw15_compress(buff)
-            zip_buff = b"".join(compressed)
+            #the data is compressed straight from the array memory, with
+            #lzw15 unless the header asks for deflate (zlib), which is much
+            #faster but readable only by this library
+            compression = self.find_header_info_value("compression")
+            if compression == "deflate":
+                zip_buff = zlib.compress(np.ascontiguousarray(self._data.data), 1)
+            elif compression is None or compression == "lzw15":
+                if self.find_header_info_value("tiled") == "1":
+                    #bands of tile_rows rows are compressed separately, in
+                    #parallel by up to workers processes when workers > 1,
+                    #the compressed size of each tile is saved in the header
+                    tiles = _compress_tiles(self._data.data, tile_rows, workers)
+                    zip_buff = b"".join(tiles)
+                    tile_sizes = ",".join(str(len(tile)) for tile in tiles)
+                    info_tiles = self.find_header_info("compressed_tile_sizes")
+                    if info_tiles is None:
+                        self.__append_header_info("compressed_tile_sizes", tile_sizes)
+                    else:
+                        info_tiles[1] = tile_sizes
+                else:
+                    zip_buff = lzw15_compresstobytes(np.ascontiguousarray(self._data.data))
+            else:
+                raise IOError("unsupported compression '%s' of product data" % compression)
             zip_size = len(zip_buff)
             if zip_size <= 0 or zip_size > buff_size:
                 raise IOError("error during compression of product data")
@@ -190,31 +266,45 @@ class ProductFile:
         else:
             info_compressed[1] = "0"
 
-        buff_size: int = self._data.num_rows * self._data.num_cols
         info_uncompressed[1] = str(buff_size)
 
-        #openm file for binary writing
+        #a file memory mapped by load_file can't be truncated, arrays mapped
+        #from it would become invalid (and so would the data being saved):
+        #in that case the product is written to a temporary file, which
+        #then replaces the mapped one, still alive until it is unmapped
         self._file_name = file_name
-        f = open(self._file_name, "wb")
-
-        #save header info
-        for name, value in self._header_info:
-            key: str = self.__normalize_key_name_for_save(name)
-            line: str = "%s=%s\n" % (key, value)
-            f.write(line.encode())
-        f.write("end_header\n".encode())
+        write_name: str = file_name
+        if self.__is_mapped_file(file_name):
+            fd, write_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)))
+            os.close(fd)
+            shutil.copymode(file_name, write_name)
 
-        #save tables
-        for table in self._tables:
-            table.data.tofile(f)
-
-        #save data
-        if compress and zip_buff is not None and zip_size > 0:
-            f.write(zip_buff)
-        else:
-            self._data.data.tofile(f)
-
-        f.close()
+        #open file for binary writing
+        try:
+            with open(write_name, "wb") as f:
+                #save header info, the whole text header is encoded and written at once
+                lines: List[str] = ["%s=%s\n" % (self.__normalize_key_name_for_save(name), value)
+                                    for name, value in self._header_info]
+                lines.append("end_header\n")
+                f.write("".join(lines).encode())
+
+                #save tables, arrays are written through the buffered file object
+                #instead of tofile, which flushes and writes them on its own
+                for table in self._tables:
+                    f.write(np.ascontiguousarray(table.data))
+
+                #save data
+                if compress and zip_buff is not None and zip_size > 0:
+                    f.write(zip_buff)
+                else:
+                    f.write(np.ascontiguousarray(self._data.data))
+        except BaseException:
+            if write_name != file_name:
+                os.remove(write_name)
+            raise
+
+        if write_name != file_name:
+            os.replace(write_name, file_name)
 
     def get_header_info(self) -> list:
         return self._header_info
@@ -236,11 +326,10 @@ class ProductFile:
         if info is not None:
             raise ValueError("can't add header info '%s': an info with that name is already present" % name)
         
-        self._header_info.append([name, value])
+        self.__append_header_info(name, value)
 
     def find_header_info(self, search: str):
-        list = [x for x in self._header_info if x[0] == search]
-        return list[0] if len(list) > 0 else None
+        return self._header_index.get(search)
 
     def find_header_info_value(self, search: str) -> str:
         info = self.find_header_info(search)
@@ -268,44 +357,111 @@ class ProductFile:
         count: int = 1
         while True:
             search: str = key if count == 1 else key + str(count)
-            if len([x for x in self._header_info if x[0] == search]) == 0:
+            if search not in self._header_index:
                 return search
             count += 1
 
+    @staticmethod
+    def __find_header_size(data) -> int:
+        #returns the size in bytes of the text header, up to and including
+        #the line 'end_header', or -1 if that line is not found
+        pos: int = 0
+        while True:
+            index: int = data.find(b"end_header", pos)
+            if index < 0:
+                return -1
+            line_end: int = data.find(b"\n", index)
+            line_end = len(data) if line_end < 0 else line_end + 1
+            if ((index == 0 or data[index-1:index] == b"\n") and
+                    data[index:line_end].rstrip() == b"end_header"):
+                return line_end
+            pos = index + 1
+
+    def __append_header_info(self, name: str, value: str):
+        info = [name, value]
+        self._header_info.append(info)
+        #the first entry with a given name is the one found by name
+        self._header_index.setdefault(name, info)
+
     def __normalize_key_name_for_save(self, key: str):
-        keys_list = ["table_name", "table_size", "param_name", "param_value"]
-        for item in keys_list:
-            if key.startswith(item):
-                return item
+        #most of the keys have none of the prefixes, they are discarded by a
+        #single startswith call before looking for the matching prefix
+        if key.startswith(self.__SAVE_KEY_PREFIXES):
+            for item in self.__SAVE_KEY_PREFIXES:
+                if key.startswith(item):
+                    return item
             
         return key
 
+    def __is_mapped_file(self, file_name: str) -> bool:
+        if self.__mapped_file_id is None:
+            return False
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return False
+        return (stat.st_dev, stat.st_ino) == self.__mapped_file_id
 
-    def __is_vad(self):
-        pid = self.find_header_info_value("pid")
-        if pid[0] == 'V' and pid[1] == 'A':
-            return True
-        
-        format = self.find_header_info_value("format")
-        if format == "VADSTR":
-            return True
-        
-        return False
+    def __load_pending_data(self):
+        pending = self.__pending_data
+        self.__pending_data = None
+        self.__build_data(*pending)
 
-    def __is_vvp(self):
-        pid = self.find_header_info_value("pid")
-        if pid[0] == 'V' and pid[1] == 'V':
-            return True
-        
-        format = self.find_header_info_value("format")
-        if format == "VVPSTR":
-            return True
-        
-        return False
+    def __build_data(self, view, zip_size: int, unzip_size: int, data_type: ProductDataType, data_values: dict):
+        #values of the header as it was when the file was loaded
+        header_value = data_values.get
 
-    def __is_vpr(self):
-        pid = self.find_header_info_value("pid")
-        if pid[0] == 'Z' and pid[1] == 'Z':
-            return True
-        
-        return False
\ No newline at end of file
+        #uncompress if necessary
+        if zip_size != 0 and zip_size != unzip_size:
+            compression = header_value("compression")
+            if compression == "deflate":
+                #products written by this library may be compressed with
+                #zlib instead of lzw15 (see save_file)
+                try:
+                    buffer = np.frombuffer(bytearray(zlib.decompress(view, bufsize=unzip_size)), dtype=np.uint8)
+                except zlib.error:
+                    raise IOError("error during decompression of product data")
+            elif compression is None or compression == "lzw15":
+                #the uncompressed size is known from the header, the data is
+                #decompressed directly into the final buffer without joining
+                #the decoded strings first. Tiles of tiled products are
+                #decompressed one after the other into the same buffer
+                buffer = np.empty(unzip_size, dtype=np.uint8)
+                tile_sizes = header_value("compressed_tile_sizes") if header_value("tiled") == "1" else None
+                try:
+                    sizes = [len(view)] if tile_sizes is None else [int(size) for size in tile_sizes.split(",")]
+                    decoded_size: int = 0
+                    pos: int = 0
+                    for size in sizes:
+                        decoded_size += lzw15_decompress_into(view[pos:pos + size], buffer[decoded_size:])
+                        pos += size
+                except ValueError:
+                    raise IOError("error during decompression of product data")
+                buffer = buffer[:decoded_size]
+            else:
+                raise IOError("unsupported compression '%s' of product data" % compression)
+        else:
+            buffer = np.frombuffer(view, dtype=np.uint8)
+
+        #reshape data read into a 2d matrix and store inside internal _data
+        if data_type == ProductDataType.Polar:
+            num_rays: int = int(header_value("row"))
+            num_gates: int = int(header_value("column"))
+            #create self._data as a ProductDataPolar object, here
+            #buffer is a 1D array but inside the constructor of ProductDataPolar
+            #it will be reshaped to be a 2D array with num_rays rows and num_gates cols
+            self._data = ProductDataPolar(num_rays, num_gates, buffer)
+        elif data_type == ProductDataType.Rect:
+            x: int = int(header_value("column"))
+            y: int = int(header_value("row"))
+            xres: float = float(header_value("rect_xres"))
+            yres: float = float(header_value("rect_yres"))
+            #create self._data as a ProductDataRect object, here
+            #buffer is a 1D array but inside the constructor of ProductDataRect
+            #it will be reshaped to be a 2D array with y rows and x cols
+            self._data = ProductDataRect(x, y, xres, yres, buffer)
+        elif data_type == ProductDataType.VertLevels:
+            num_floats32: int = int(header_value("row"))
+            num_levels: int = int(header_value("column"))
+            #create self._data as a ProductDataVertLevels
+            self._data = ProductDataVertLevels(num_floats32, num_levels, buffer)
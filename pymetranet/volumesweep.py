@@ -3,13 +3,18 @@
 import math
 from enum import IntEnum
 from typing import List
+import numpy as np
 
 from .xml_util import XmlUtil
 
 class DataMomentHeader:
-    def __init__(self):
-        self.momentid = 0
-        self.datasize = 0
+    #rays, moments and their headers are allocated once per ray (and per moment),
+    #__slots__ avoids the per instance __dict__ of all these small objects
+    __slots__ = ("momentid", "datasize")
+
+    def __init__(self, momentid: int=0, datasize: int=0):
+        self.momentid = momentid
+        self.datasize = datasize
         
 class MomentUUid(IntEnum):
     #RSP moments
@@ -104,33 +109,44 @@ class MomentInfo:
         self.scaletype = 0
         
 class RayHeader:
-    def __init__(self):
-        self.length = 0
-        self.startangle = 0
-        self.endangle = 0
-        self.sequence = 0
-        self.numpulses = 0
-        self.databytes = 0
-        self.prf = float("nan")
-        self.datetime = 0
-        self.dataflags = 0
-        self.metadatasize = 0
-        self.numbatches = 0
+    __slots__ = ("length", "startangle", "endangle", "sequence", "numpulses",
+        "databytes", "prf", "datetime", "dataflags", "metadatasize",
+        "numbatches", "batchesinfo", "metadata")
+
+    def __init__(self, length: int=0, startangle: int=0, endangle: int=0, sequence: int=0,
+            numpulses: int=0, databytes: int=0, prf: float=float("nan"), datetime: int=0,
+            dataflags: int=0, metadatasize: int=0, numbatches: int=0):
+        self.length = length
+        self.startangle = startangle
+        self.endangle = endangle
+        self.sequence = sequence
+        self.numpulses = numpulses
+        self.databytes = databytes
+        self.prf = prf
+        self.datetime = datetime
+        self.dataflags = dataflags
+        self.metadatasize = metadatasize
+        self.numbatches = numbatches
         self.batchesinfo = []
         self.metadata = ""
 
 class BatchInfo:
-    def __init__(self):
-        self.length = 0
-        self.startrange = float("nan")
-        self.prf = float("nan")
-        self.numpulses = 0
-        self.dprf = 0
-        self.angperc = float("nan")
+    __slots__ = ("length", "startrange", "prf", "numpulses", "dprf", "angperc")
+
+    def __init__(self, length: int=0, startrange: float=float("nan"), prf: float=float("nan"),
+            numpulses: int=0, dprf: int=0, angperc: float=float("nan")):
+        self.length = length
+        self.startrange = startrange
+        self.prf = prf
+        self.numpulses = numpulses
+        self.dprf = dprf
+        self.angperc = angperc
     
 class Ray:
     _K_CONV_DEG = 360.0 / 65535.0
     
+    __slots__ = ("rayheader", "moments")
+
     def __init__(self):
         self.rayheader = RayHeader()
         self.moments = []
@@ -163,9 +179,14 @@ class Ray:
         return 0 if (value >> 16) == 0xFFFF else (value >> 16) * Ray._K_CONV_DEG
 
 class Moment:
+    __slots__ = ("datamomentheader", "gates")
+
     def __init__(self):
         self.datamomentheader = DataMomentHeader()
-        self.gates = []
+        #typed array of the raw gate values (uint8, uint16 or float32
+        #depending on the data format of the moment). Gates of loaded sweeps
+        #are writable views on a buffer shared by the whole sweep
+        self.gates: np.ndarray = np.empty(0, dtype=np.uint8)
         
     @property
     def num_gates(self) -> int:
@@ -187,10 +208,39 @@ class Moment:
             if self.gates[index] == 0:
                 return float("nan")
 
-            exp =  (1 - self.gates[index]) / mom_info.factorb
+            #gates may be unsigned numpy integers, convert to int to avoid
+            #wrapping around when subtracting
+            exp =  (1 - int(self.gates[index])) / mom_info.factorb
             return mom_info.factora + mom_info.factorc * pow(10, exp)
 
         return float("nan")
+
+    def get_real_values_array(self, mom_info) -> np.ndarray:
+        #same conversion of get_real_value but applied to all the gates at once
+        return Moment.get_real_from_dn_array(mom_info, self.gates)
+    
+    @staticmethod
+    def get_real_from_dn_array(mom_info: MomentInfo, dn: np.ndarray) -> np.ndarray:
+        #converts an array of any shape of raw gate values into a float64
+        #array of real values, 0 (no data) is converted into nan
+        dn = np.asarray(dn)
+        if mom_info.scaletype == MomentInfo.SCALE_TYPE_LINEAR:
+            if mom_info.dataformat == MomentInfo.DATA_FORMAT_FLOAT_32_BIT:
+                return dn.astype(np.float64)
+
+            values = (mom_info.factora * dn) + mom_info.factorb
+        elif mom_info.scaletype == MomentInfo.SCALE_TYPE_LOG:
+            if mom_info.dataformat == MomentInfo.DATA_FORMAT_FLOAT_32_BIT:
+                return dn.astype(np.float64)
+
+            exp = (1.0 - dn) / mom_info.factorb
+            values = mom_info.factora + mom_info.factorc * np.power(10.0, exp)
+        else:
+            return np.full(dn.shape, np.nan)
+
+        #a digital number of 0 means no data
+        values[dn == 0] = np.nan
+        return values
     
     @staticmethod
     def get_real_from_dn(mom_info: MomentInfo, dn: int) -> float:
@@ -233,6 +283,40 @@ class PolarSweep:
                 
         return None
         
+    def get_moment_matrix(self, mom_id: int, num_gates: int = None) -> np.ndarray:
+        #returns the real values of the moment for all the rays of the sweep
+        #as a (num_rays, num_gates) matrix, the rows of the rays without
+        #that moment are nan. If num_gates is None it is the number of gates
+        #of the first ray with the moment, rays with a different number of
+        #gates are truncated or padded with nan
+        mom_info = self.get_moment_info_by_id(mom_id)
+        if mom_info is None:
+            raise ValueError(f"can't get information of moment id {mom_id}(0x{mom_id:X})")
+            
+        moms = [ray.get_moment_by_id(mom_id) for ray in self.rays]
+        rows = [i for i, mom in enumerate(moms) if mom is not None]
+        if not rows:
+            return np.full((len(moms), 0 if num_gates is None else num_gates), np.nan)
+        if num_gates is None:
+            num_gates = moms[rows[0]].num_gates
+            
+        gates = [moms[i].gates[:num_gates] for i in rows]
+        if all(len(ray_gates) == num_gates for ray_gates in gates):
+            #the raw gates of all the rays are stacked and converted at once
+            values = Moment.get_real_from_dn_array(mom_info, np.stack(gates))
+            if len(rows) == len(moms):
+                return values
+            
+            ret = np.full((len(moms), num_gates), np.nan)
+            ret[rows] = values
+            return ret
+            
+        #rays shorter than num_gates are converted one by one
+        ret = np.full((len(moms), num_gates), np.nan)
+        for i, ray_gates in zip(rows, gates):
+            ret[i, :len(ray_gates)] = Moment.get_real_from_dn_array(mom_info, ray_gates)
+        return ret
+        
 class PolMode(IntEnum):
     Undefined = 0
     H = 1
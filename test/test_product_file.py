@@ -0,0 +1,126 @@
+#!/bin/env python3
+
+import os
+import numpy as np
+
+from pymetranet import ProductFile, ProductDataRect
+
+def create_rect_product(file_name: str, data: np.ndarray, compress: bool, **infos) -> None:
+    prod = ProductFile()
+    prod.add_header_info("pid", "CZC")
+    prod.add_header_info("format", "RECT")
+    prod.add_header_info("row", str(data.shape[0]))
+    prod.add_header_info("column", str(data.shape[1]))
+    prod.add_header_info("table_num", "0")
+    prod.add_header_info("compressed_bytes", "")
+    prod.add_header_info("uncompressed_bytes", "")
+    prod.add_header_info("rect_xres", "1.000000")
+    prod.add_header_info("rect_yres", "1.000000")
+    for name, value in infos.items():
+        prod.add_header_info(name, value)
+    prod.data = ProductDataRect(data.shape[1], data.shape[0], 1.0, 1.0, data)
+    prod.save_file(file_name, compress=compress)
+
+def test_save_over_memory_mapped_file(tmp_path):
+    file_name = str(tmp_path / "rect.prd")
+    data = (np.arange(300 * 200) % 251).astype(np.uint8).reshape(300, 200)
+    create_rect_product(file_name, data, compress=False)
+    size = os.path.getsize(file_name)
+
+    for compress in (False, True, False):
+        prod = ProductFile()
+        prod.load_file(file_name, memory_map=True)
+        mapped = prod.data.data
+        prod.save_file(file_name, compress=compress)
+
+        #the data loaded before saving is still readable and unchanged
+        assert np.array_equal(mapped, data)
+        assert np.array_equal(prod.data.data, data)
+
+        reloaded = ProductFile()
+        reloaded.load_file(file_name)
+        assert np.array_equal(reloaded.data.data, data)
+
+    assert os.path.getsize(file_name) == size
+    assert os.listdir(str(tmp_path)) == ["rect.prd"]
+
+def test_lazy_load_with_changed_header(tmp_path):
+    file_name = str(tmp_path / "rect.prd")
+    data = (np.arange(120 * 90) % 13).astype(np.uint8).reshape(120, 90)
+    create_rect_product(file_name, data, compress=True)
+
+    #the data is decoded as it was saved, even if the header is changed
+    #before the first access
+    prod = ProductFile()
+    prod.load_file(file_name, lazy=True)
+    prod.add_header_info("compression", "deflate")
+    prod.add_header_info("tiled", "1")
+    prod.save_file(file_name, tile_rows=50)
+    assert np.array_equal(prod.data.data, data)
+
+    reloaded = ProductFile()
+    reloaded.load_file(file_name)
+    assert reloaded.find_header_info_value("compression") == "deflate"
+    assert np.array_equal(reloaded.data.data, data)
+
+def load_reference(tmp_path):
+    #product saved with the default lzw15 compression and loaded eagerly
+    file_name = str(tmp_path / "lzw.prd")
+    data = ((np.arange(120 * 90) // 7) % 17).astype(np.uint8).reshape(120, 90)
+    create_rect_product(file_name, data, compress=True)
+    prod = ProductFile()
+    prod.load_file(file_name)
+    assert np.array_equal(prod.data.data, data)
+    return file_name, prod.data.data
+
+def test_deflate_round_trip(tmp_path):
+    file_name, reference = load_reference(tmp_path)
+    prod = ProductFile()
+    prod.load_file(file_name)
+    prod.add_header_info("compression", "deflate")
+    deflate_name = str(tmp_path / "deflate.prd")
+    prod.save_file(deflate_name)
+
+    for lazy in (False, True):
+        reloaded = ProductFile()
+        reloaded.load_file(deflate_name, lazy=lazy)
+        assert reloaded.find_header_info_value("compression") == "deflate"
+        assert 0 < int(reloaded.find_header_info_value("compressed_bytes")) < reference.size
+        assert np.array_equal(reloaded.data.data, reference)
+
+def test_tiled_round_trip(tmp_path):
+    file_name, reference = load_reference(tmp_path)
+    prod = ProductFile()
+    prod.load_file(file_name)
+    prod.add_header_info("tiled", "1")
+
+    #50 doesn't divide the 120 rows, the last tile has 20 rows
+    saved = []
+    for workers in (None, 2):
+        tiled_name = str(tmp_path / ("tiled_%s.prd" % workers))
+        prod.save_file(tiled_name, tile_rows=50, workers=workers)
+        with open(tiled_name, "rb") as f:
+            saved.append(f.read())
+
+        reloaded = ProductFile()
+        reloaded.load_file(tiled_name)
+        assert len(reloaded.find_header_info_value("compressed_tile_sizes").split(",")) == 3
+        assert np.array_equal(reloaded.data.data, reference)
+
+    #parallel and sequential compression write the same file
+    assert saved[0] == saved[1]
+
+def test_lazy_round_trip(tmp_path):
+    file_name, reference = load_reference(tmp_path)
+    prod = ProductFile()
+    prod.load_file(file_name, lazy=True)
+    assert prod.find_header_info_value("row") == "120"
+    assert np.array_equal(prod.data.data, reference)
+
+    lazy_name = str(tmp_path / "lazy.prd")
+    prod = ProductFile()
+    prod.load_file(file_name, lazy=True)
+    prod.save_file(lazy_name)
+    reloaded = ProductFile()
+    reloaded.load_file(lazy_name)
+    assert np.array_equal(reloaded.data.data, reference)